@@ -19,12 +19,22 @@ from __future__ import annotations
 
 import argparse
 import json
+from collections import deque
 from pathlib import Path
-from typing import List
+from typing import List, Optional, Tuple
 
 import cv2
 import numpy as np
-from PIL import Image
+
+try:
+    from numba import njit, prange
+except ImportError:  # optional: falls back to the OpenCV distance path
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to compact stdlib json
+    orjson = None
 
 # -------- Contour export tunables --------
 MIN_CONTOUR_AREA = 800     # px^2 (lower if small objects are being dropped)
@@ -33,10 +43,16 @@ MAX_POINTS = 256
 
 # -------- CV tunables --------
 BORDER = 12                # px: sample background color from border
+BG_SAMPLE_STRIDE = 4       # use every k-th border pixel for the bg estimate
 BG_DIST_THRESH = 28        # higher => fewer pixels considered "object"
 OPEN_ITERS = 1
 CLOSE_ITERS = 2
 
+# -------- Output --------
+PNG_COMPRESSION = 3        # cv2 PNG level 0-9 (lower = faster encode, slightly larger file)
+
+_K3 = np.ones((3, 3), np.uint8)   # shared 3x3 structuring element
+
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser()
@@ -45,45 +61,121 @@ def parse_args() -> argparse.Namespace:
     return p.parse_args()
 
 
-def overlay_mask(rgb: np.ndarray, mask01: np.ndarray, alpha: float = 0.55) -> np.ndarray:
-    out = rgb.astype(np.float32).copy()
-    m = mask01.astype(bool)
-    color = np.array([0, 255, 0], dtype=np.float32)
-    out[m] = out[m] * (1 - alpha) + color * alpha
-    return np.clip(out, 0, 255).astype(np.uint8)
+def overlay_mask(rgb: np.ndarray, mask: np.ndarray, alpha: float = 0.55) -> np.ndarray:
+    # uint8 throughout: blend the whole frame with a SIMD addWeighted, then select by mask
+    color_img = np.empty_like(rgb)
+    color_img[:] = (0, 255, 0)
+    blended = cv2.addWeighted(rgb, 1 - alpha, color_img, alpha, 0)
+    return np.where((mask > 0)[:, :, None], blended, rgb)
+
+
+def _write_json(path: Path, payload: dict):
+    """Compact JSON write (Unity's parser does not need indentation)."""
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(payload))
+    else:
+        path.write_text(json.dumps(payload, separators=(",", ":")))
 
 
-def save_mask_png(mask01: np.ndarray, path: Path):
-    Image.fromarray((mask01.astype(np.uint8) * 255)).save(path)
+def _imwrite_png(path: Path, arr: np.ndarray):
+    """Write an RGB/RGBA/grayscale uint8 array as PNG through OpenCV."""
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA if arr.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(str(path), arr, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]):
+        raise RuntimeError(f"Could not write image: {path}")
+
+
+def open_close(mask: np.ndarray, open_iters: int, close_iters: int, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    OPEN(open_iters) followed by CLOSE(close_iters) on a binary mask.
+    The trailing dilations of OPEN and the leading dilations of CLOSE are
+    merged into a single dilate (same result with a rectangular kernel),
+    so the chain is 3 passes instead of 4.
+    All passes run in place on dst; pass dst=mask to reuse the input buffer.
+    """
+    if dst is None:
+        dst = mask.copy()
+    elif dst is not mask:
+        np.copyto(dst, mask)
+    if open_iters > 0:
+        cv2.erode(dst, _K3, dst=dst, iterations=open_iters)
+    if open_iters + close_iters > 0:
+        cv2.dilate(dst, _K3, dst=dst, iterations=open_iters + close_iters)
+    if close_iters > 0:
+        cv2.erode(dst, _K3, dst=dst, iterations=close_iters)
+    return dst
+
+
+def _rdp_keep(ring: np.ndarray, eps: float, max_points: int) -> np.ndarray:
+    """
+    Ramer-Douglas-Peucker on a closed ring (last point == first point).
+    Returns a bool mask over ring of the vertices to keep. Spans are processed
+    from an explicit work queue (no recursion), perpendicular distances for a
+    span are one vectorized expression, and splitting stops once max_points
+    vertices are kept.
+    """
+    n = ring.shape[0] - 1
+    keep = np.zeros(ring.shape[0], dtype=bool)
+    far = int(np.argmax(np.hypot(*(ring[:n] - ring[0]).T)))
+    keep[0] = keep[far] = keep[n] = True
+    kept = 2
+
+    spans = deque([(0, far), (far, n)])
+    while spans and kept < max_points:
+        lo, hi = spans.popleft()
+        if hi - lo < 2:
+            continue
+        d = ring[hi] - ring[lo]
+        seg = ring[lo + 1 : hi] - ring[lo]
+        norm = float(np.hypot(d[0], d[1]))
+        if norm > 0.0:
+            dist = np.abs(d[0] * seg[:, 1] - d[1] * seg[:, 0]) / norm
+        else:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        i = int(np.argmax(dist))
+        if dist[i] <= eps:
+            continue
+        mid = lo + 1 + i
+        keep[mid] = True
+        kept += 1
+        spans.append((lo, mid))
+        spans.append((mid, hi))
+
+    return keep
 
 
 def _simplify_polygon(poly_xy: np.ndarray) -> List[List[int]]:
     if poly_xy.shape[0] < 3:
         return []
 
-    pts = poly_xy.astype(np.float32).reshape(-1, 1, 2)
+    pts = poly_xy.astype(np.float32)
     peri = cv2.arcLength(pts, True)
     eps = max(1.0, EPS_FRACTION * peri)
-    approx = cv2.approxPolyDP(pts, eps, True)
-    approx_xy = approx.reshape(-1, 2)
 
-    if approx_xy.shape[0] > MAX_POINTS:
-        idx = np.linspace(0, approx_xy.shape[0] - 1, MAX_POINTS).astype(int)
-        approx_xy = approx_xy[idx]
+    ring = np.vstack([pts, pts[:1]])
+    approx_xy = ring[:-1][_rdp_keep(ring, eps, MAX_POINTS)[:-1]]
 
-    out = [[int(round(x)), int(round(y))] for x, y in approx_xy]
+    out = np.rint(approx_xy).astype(np.int32).tolist()
     if len(out) >= 2 and out[0] == out[-1]:
         out = out[:-1]
     return out
 
 
-def mask_to_contours_json(mask01: np.ndarray, out_json: Path, image_w: int, image_h: int) -> int:
-    m = (mask01.astype(np.uint8) * 255)
+def mask_to_contours_json(mask255: np.ndarray, out_json: Path, image_w: int, image_h: int) -> Tuple[int, int]:
+    """
+    mask255 (H,W) uint8, 255=object. It must already be morphologically
+    cleaned (cv_segment_objects does OPEN/CLOSE); no further cleanup is done here.
+    Returns (exported polygon count, connected component count of mask255).
+    """
+    m = mask255
 
-    # Mild cleanup for contour stability
-    kernel = np.ones((3, 3), np.uint8)
-    m = cv2.morphologyEx(m, cv2.MORPH_OPEN, kernel, iterations=1)
-    m = cv2.morphologyEx(m, cv2.MORPH_CLOSE, kernel, iterations=1)
+    # Drop blobs that can never reach MIN_CONTOUR_AREA before tracing: a
+    # component's bounding box area is an upper bound on its outer contour area.
+    num, labels, stats, _ = cv2.connectedComponentsWithStats(m, connectivity=8)
+    bbox_area = stats[:, cv2.CC_STAT_WIDTH] * stats[:, cv2.CC_STAT_HEIGHT]
+    lut = np.zeros(num, dtype=np.uint8)
+    lut[1:][bbox_area[1:] >= MIN_CONTOUR_AREA] = 255
+    m = lut[labels]
 
     contours, _ = cv2.findContours(m, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
@@ -113,8 +205,8 @@ def mask_to_contours_json(mask01: np.ndarray, out_json: Path, image_w: int, imag
         "polygons": polys,
         "notes": "CV segmentation. Coordinates are image pixels (origin top-left). Unity converts to local collider points.",
     }
-    out_json.write_text(json.dumps(payload, indent=2))
-    return len(polys)
+    _write_json(out_json, payload)
+    return len(polys), num - 1
 
 
 def estimate_bg_color(rgb: np.ndarray, border: int) -> np.ndarray:
@@ -129,35 +221,74 @@ def estimate_bg_color(rgb: np.ndarray, border: int) -> np.ndarray:
     samples = np.concatenate(
         [top.reshape(-1, 3), bottom.reshape(-1, 3), left.reshape(-1, 3), right.reshape(-1, 3)],
         axis=0,
-    )
+    )[::BG_SAMPLE_STRIDE]
 
-    # robust: median color
-    return np.median(samples, axis=0).astype(np.uint8)
+    # robust: median color (selection, not a full sort)
+    k = samples.shape[0] // 2
+    return np.partition(samples, k, axis=0)[k].astype(np.uint8)
 
 
-def cv_segment_objects(rgb: np.ndarray) -> np.ndarray:
+def bg_dist_sq(rgb: np.ndarray, bg: np.ndarray) -> np.ndarray:
     """
-    Returns mask01 (H,W) where 1=object, 0=background.
+    Squared RGB distance of every pixel to bg, as (H,W) int32.
+    Stays in integer space (no sqrt, no float buffer) so it can be
+    thresholded directly against BG_DIST_THRESH**2.
+    """
+    d = cv2.absdiff(rgb, (int(bg[0]), int(bg[1]), int(bg[2]), 0))
+    sq = None
+    for ch in cv2.split(d):
+        ch_sq = cv2.multiply(ch, ch, dtype=cv2.CV_32S)
+        sq = ch_sq if sq is None else cv2.add(sq, ch_sq)
+    return sq
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _bg_mask(rgb, bg_r, bg_g, bg_b, thr2):
+        """Fused diff -> squared distance -> threshold; one read of rgb, returns (mask, dist_sq)."""
+        h, w = rgb.shape[0], rgb.shape[1]
+        mask = np.empty((h, w), np.uint8)
+        dist_sq = np.empty((h, w), np.int32)
+        for i in prange(h):
+            for j in range(w):
+                dr = np.int32(rgb[i, j, 0]) - bg_r
+                dg = np.int32(rgb[i, j, 1]) - bg_g
+                db = np.int32(rgb[i, j, 2]) - bg_b
+                s = dr * dr + dg * dg + db * db
+                dist_sq[i, j] = s
+                mask[i, j] = 255 if s > thr2 else 0
+        return mask, dist_sq
+
+else:
+    _bg_mask = None
+
+
+def cv_segment_objects(rgb: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Returns (mask255, bg, dist_sq):
+      mask255 (H,W) uint8 where 255=object, 0=background
+      bg      estimated background RGB (uint8)
+      dist_sq (H,W) int32 squared color distance to bg (reused by the debug montage)
     Strategy:
       - estimate background color from border
-      - compute per-pixel color distance to background
+      - compute per-pixel squared color distance to background
       - threshold to get foreground
       - morph cleanup
     """
-    bg = estimate_bg_color(rgb, BORDER).astype(np.int16)
-    diff = rgb.astype(np.int16) - bg[None, None, :]
-    dist = np.sqrt((diff * diff).sum(axis=2)).astype(np.float32)
+    bg = estimate_bg_color(rgb, BORDER)
+    thr2 = BG_DIST_THRESH * BG_DIST_THRESH
 
     # foreground = pixels far enough from bg
-    mask = (dist > float(BG_DIST_THRESH)).astype(np.uint8)
+    if _bg_mask is not None:
+        mask, dist_sq = _bg_mask(rgb, np.int32(bg[0]), np.int32(bg[1]), np.int32(bg[2]), np.int32(thr2))
+    else:
+        dist_sq = bg_dist_sq(rgb, bg)
+        mask = cv2.compare(dist_sq, thr2, cv2.CMP_GT)
 
-    kernel = np.ones((3, 3), np.uint8)
-    if OPEN_ITERS > 0:
-        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=OPEN_ITERS)
-    if CLOSE_ITERS > 0:
-        mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=CLOSE_ITERS)
+    mask = open_close(mask, OPEN_ITERS, CLOSE_ITERS, dst=mask)
 
-    return mask
+    return mask, bg, dist_sq
 
 
 def main():
@@ -177,49 +308,38 @@ def main():
     print(f"[INFO] out: {out_dir.resolve()}")
     print(f"[INFO] image: {w}x{h}")
 
-    mask01 = cv_segment_objects(rgb)
+    mask255, bg, dist_sq = cv_segment_objects(rgb)
 
     # Save masks + visuals
-    save_mask_png(mask01, out_dir / "objects_mask.png")
+    _imwrite_png(out_dir / "objects_mask.png", mask255)
 
-    rgba_obj = np.dstack([rgb, (mask01 * 255).astype(np.uint8)])
-    Image.fromarray(rgba_obj).save(out_dir / "objects_only_rgba.png")
+    rgba_obj = cv2.merge((rgb[..., 0], rgb[..., 1], rgb[..., 2], mask255))
+    _imwrite_png(out_dir / "objects_only_rgba.png", rgba_obj)
 
-    overlay = overlay_mask(rgb, mask01)
-    Image.fromarray(overlay).save(out_dir / "overlay.png")
+    overlay = overlay_mask(rgb, mask255)
+    _imwrite_png(out_dir / "overlay.png", overlay)
 
     # Debug montage
-    bg = estimate_bg_color(rgb, BORDER)
     bg_patch = np.full((80, 80, 3), bg, dtype=np.uint8)
-    dist_vis = None
-    try:
-        bg_i16 = bg.astype(np.int16)
-        diff = rgb.astype(np.int16) - bg_i16[None, None, :]
-        dist = np.sqrt((diff * diff).sum(axis=2)).astype(np.float32)
-        dist_norm = cv2.normalize(dist, None, 0, 255, cv2.NORM_MINMAX).astype(np.uint8)
-        dist_vis = cv2.cvtColor(dist_norm, cv2.COLOR_GRAY2RGB)
-    except Exception:
-        dist_vis = np.zeros_like(rgb)
-
-    mask_vis = (mask01 * 255).astype(np.uint8)
-    mask_vis = cv2.cvtColor(mask_vis, cv2.COLOR_GRAY2RGB)
+    dist_norm = cv2.normalize(dist_sq, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+    dist_vis = cv2.cvtColor(dist_norm, cv2.COLOR_GRAY2RGB)
+
+    mask_vis = cv2.cvtColor(mask255, cv2.COLOR_GRAY2RGB)
+    # 2x nearest-neighbour downscale via strided views (concatenate does the copy)
     debug = np.concatenate(
         [
-            cv2.resize(rgb, (w // 2, h // 2)),
-            cv2.resize(dist_vis, (w // 2, h // 2)),
-            cv2.resize(mask_vis, (w // 2, h // 2)),
-            cv2.resize(overlay, (w // 2, h // 2)),
+            rgb[::2, ::2],
+            dist_vis[::2, ::2],
+            mask_vis[::2, ::2],
+            overlay[::2, ::2],
         ],
         axis=1,
     )
-    Image.fromarray(debug).save(out_dir / "debug_cv.png")
-    Image.fromarray(bg_patch).save(out_dir / "bg_color.png")
-
-    n_polys = mask_to_contours_json(mask01, out_dir / "objects_contour.json", w, h)
+    _imwrite_png(out_dir / "debug_cv.png", debug)
+    _imwrite_png(out_dir / "bg_color.png", bg_patch)
 
-    # Also print connected component count for quick sanity
-    num_labels, _ = cv2.connectedComponents((mask01 * 255).astype(np.uint8))
-    comps = num_labels - 1
+    # Also reports the connected component count for quick sanity
+    n_polys, comps = mask_to_contours_json(mask255, out_dir / "objects_contour.json", w, h)
 
     print(f"[INFO] connected components: {comps}")
     print(f"[INFO] exported polygons: {n_polys}")
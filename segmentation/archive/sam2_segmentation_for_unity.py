@@ -22,17 +22,22 @@ from __future__ import annotations
 
 import argparse
 import json
+from collections import deque
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 import cv2
 import numpy as np
-from PIL import Image
 import torch
 
 from sam2.build_sam import build_sam2
 from sam2.automatic_mask_generator import SAM2AutomaticMaskGenerator
 
+try:
+    import orjson
+except ImportError:  # optional: falls back to compact stdlib json
+    orjson = None
+
 
 # ---- Defaults (keep same as your current script) ----
 DEFAULT_IN_PATH = Path("./out/captured.png")
@@ -47,6 +52,11 @@ MIN_CONTOUR_AREA = 800   # Filter tiny blobs from collider export (in pixels)
 EPS_FRACTION = 0.01      # approx_epsilon = EPS_FRACTION * perimeter
 MAX_POINTS = 256         # Limit points per polygon for physics stability
 
+# ---- Output ----
+PNG_COMPRESSION = 3      # cv2 PNG level 0-9 (lower = faster encode, slightly larger file)
+
+_K3 = np.ones((3, 3), np.uint8)  # shared 3x3 structuring element
+
 
 def parse_args() -> argparse.Namespace:
     p = argparse.ArgumentParser(description="Process one image with SAM2 and export Unity-ready outputs.")
@@ -84,9 +94,84 @@ def overlay_masks(rgb: np.ndarray, masks01: np.ndarray, alpha: float = 0.55) ->
     return np.clip(out, 0, 255).astype(np.uint8)
 
 
+def _write_json(path: Path, payload: dict):
+    """Compact JSON write (Unity's parser does not need indentation)."""
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(payload))
+    else:
+        path.write_text(json.dumps(payload, separators=(",", ":")))
+
+
+def _imwrite_png(path: Path, arr: np.ndarray):
+    """Write an RGB/RGBA/grayscale uint8 array as PNG through OpenCV."""
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA if arr.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+    if not cv2.imwrite(str(path), arr, [cv2.IMWRITE_PNG_COMPRESSION, PNG_COMPRESSION]):
+        raise RuntimeError(f"Could not write image: {path}")
+
+
 def save_mask_png(mask01: np.ndarray, path: Path):
     m = (mask01.astype(np.uint8) * 255)
-    Image.fromarray(m).save(path)
+    _imwrite_png(path, m)
+
+
+def open_close(mask: np.ndarray, open_iters: int, close_iters: int, dst: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    OPEN(open_iters) followed by CLOSE(close_iters) on a binary mask.
+    The trailing dilations of OPEN and the leading dilations of CLOSE are
+    merged into a single dilate (same result with a rectangular kernel),
+    so the chain is 3 passes instead of 4.
+    All passes run in place on dst; pass dst=mask to reuse the input buffer.
+    """
+    if dst is None:
+        dst = mask.copy()
+    elif dst is not mask:
+        np.copyto(dst, mask)
+    if open_iters > 0:
+        cv2.erode(dst, _K3, dst=dst, iterations=open_iters)
+    if open_iters + close_iters > 0:
+        cv2.dilate(dst, _K3, dst=dst, iterations=open_iters + close_iters)
+    if close_iters > 0:
+        cv2.erode(dst, _K3, dst=dst, iterations=close_iters)
+    return dst
+
+
+def _rdp_keep(ring: np.ndarray, eps: float, max_points: int) -> np.ndarray:
+    """
+    Ramer-Douglas-Peucker on a closed ring (last point == first point).
+    Returns a bool mask over ring of the vertices to keep. Spans are processed
+    from an explicit work queue (no recursion), perpendicular distances for a
+    span are one vectorized expression, and splitting stops once max_points
+    vertices are kept.
+    """
+    n = ring.shape[0] - 1
+    keep = np.zeros(ring.shape[0], dtype=bool)
+    far = int(np.argmax(np.hypot(*(ring[:n] - ring[0]).T)))
+    keep[0] = keep[far] = keep[n] = True
+    kept = 2
+
+    spans = deque([(0, far), (far, n)])
+    while spans and kept < max_points:
+        lo, hi = spans.popleft()
+        if hi - lo < 2:
+            continue
+        d = ring[hi] - ring[lo]
+        seg = ring[lo + 1 : hi] - ring[lo]
+        norm = float(np.hypot(d[0], d[1]))
+        if norm > 0.0:
+            dist = np.abs(d[0] * seg[:, 1] - d[1] * seg[:, 0]) / norm
+        else:
+            dist = np.hypot(seg[:, 0], seg[:, 1])
+        i = int(np.argmax(dist))
+        if dist[i] <= eps:
+            continue
+        mid = lo + 1 + i
+        keep[mid] = True
+        kept += 1
+        spans.append((lo, mid))
+        spans.append((mid, hi))
+
+    return keep
 
 
 def _simplify_polygon(poly_xy: np.ndarray) -> List[List[int]]:
@@ -97,17 +182,14 @@ def _simplify_polygon(poly_xy: np.ndarray) -> List[List[int]]:
     if poly_xy.shape[0] < 3:
         return []
 
-    pts = poly_xy.astype(np.float32).reshape(-1, 1, 2)
+    pts = poly_xy.astype(np.float32)
     peri = cv2.arcLength(pts, True)
     eps = max(1.0, EPS_FRACTION * peri)
-    approx = cv2.approxPolyDP(pts, eps, True)  # (M,1,2)
-    approx_xy = approx.reshape(-1, 2)
 
-    if approx_xy.shape[0] > MAX_POINTS:
-        idx = np.linspace(0, approx_xy.shape[0] - 1, MAX_POINTS).astype(int)
-        approx_xy = approx_xy[idx]
+    ring = np.vstack([pts, pts[:1]])
+    approx_xy = ring[:-1][_rdp_keep(ring, eps, MAX_POINTS)[:-1]]
 
-    out = [[int(round(x)), int(round(y))] for x, y in approx_xy]
+    out = np.rint(approx_xy).astype(np.int32).tolist()
     if len(out) >= 2 and out[0] == out[-1]:
         out = out[:-1]
     return out
@@ -121,9 +203,15 @@ def mask_to_contours_json(mask01: np.ndarray, out_json: Path, image_w: int, imag
     """
     m = (mask01.astype(np.uint8) * 255)
 
-    kernel = np.ones((3, 3), np.uint8)
-    m = cv2.morphologyEx(m, cv2.MORPH_OPEN, kernel, iterations=1)
-    m = cv2.morphologyEx(m, cv2.MORPH_CLOSE, kernel, iterations=1)
+    m = open_close(m, 1, 1, dst=m)
+
+    # Drop blobs that can never reach MIN_CONTOUR_AREA before tracing: a
+    # component's bounding box area is an upper bound on its outer contour area.
+    num, labels, stats, _ = cv2.connectedComponentsWithStats(m, connectivity=8)
+    bbox_area = stats[:, cv2.CC_STAT_WIDTH] * stats[:, cv2.CC_STAT_HEIGHT]
+    lut = np.zeros(num, dtype=np.uint8)
+    lut[1:][bbox_area[1:] >= MIN_CONTOUR_AREA] = 255
+    m = lut[labels]
 
     contours, _hier = cv2.findContours(m, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
 
@@ -154,7 +242,7 @@ def mask_to_contours_json(mask01: np.ndarray, out_json: Path, image_w: int, imag
         "notes": "Coordinates are in image pixels (origin top-left). Unity should convert to local collider points using pixelsPerUnit and flip Y.",
     }
 
-    out_json.write_text(json.dumps(payload, indent=2))
+    _write_json(out_json, payload)
     return len(polys)
 
 
@@ -202,33 +290,34 @@ def main():
 
     print(f"[INFO] masks found: {len(masks)}")
     if len(masks) == 0:
-        Image.fromarray(rgb).save(out_dir / "overlay.png")
+        _imwrite_png(out_dir / "overlay.png", rgb)
         print("[WARN] No masks found. Saved overlay.png as the raw image.")
         return
 
+    # Sorting N dicts by their precomputed area is cheap, and stacking in that
+    # order lets objs be a view and keeps overlay colours/blend order by size
     masks_sorted = sorted(masks, key=lambda m: m.get("area", 0), reverse=True)
     masks01 = np.stack([(m["segmentation"].astype(np.uint8)) for m in masks_sorted], axis=0)
 
     bg = masks01[0]
-    objs = masks01[1:] if masks01.shape[0] > 1 else masks01[0:0]
+    objs = masks01[1:]
 
-    obj_union = np.zeros_like(bg, dtype=np.uint8)
-    for m in objs:
-        obj_union = np.maximum(obj_union, m)
+    obj_union = objs.max(axis=0) if objs.shape[0] else np.zeros_like(bg, dtype=np.uint8)
 
     overlay_all = overlay_masks(rgb, masks01)
-    Image.fromarray(overlay_all).save(out_dir / "overlay.png")
+    _imwrite_png(out_dir / "overlay.png", overlay_all)
 
-    alpha_all = (masks01.max(axis=0) * 255).astype(np.uint8)
-    rgba_all = np.dstack([rgb, alpha_all])
-    Image.fromarray(rgba_all).save(out_dir / "segmented_rgba.png")
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    alpha_all = np.multiply(masks01.max(axis=0), 255, dtype=np.uint8)
+    rgba_all = cv2.merge((r, g, b, alpha_all))
+    _imwrite_png(out_dir / "segmented_rgba.png", rgba_all)
 
-    alpha_obj = (obj_union * 255).astype(np.uint8)
-    rgba_obj = np.dstack([rgb, alpha_obj])
-    Image.fromarray(rgba_obj).save(out_dir / "objects_only_rgba.png")
+    alpha_obj = np.multiply(obj_union, 255, dtype=np.uint8)
+    rgba_obj = cv2.merge((r, g, b, alpha_obj))
+    _imwrite_png(out_dir / "objects_only_rgba.png", rgba_obj)
 
     save_mask_png(bg, out_dir / "background_mask.png")
-    save_mask_png(obj_union, out_dir / "objects_mask.png")
+    _imwrite_png(out_dir / "objects_mask.png", alpha_obj)
 
     n_polys = mask_to_contours_json(
         mask01=obj_union,
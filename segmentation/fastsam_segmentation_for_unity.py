@@ -18,22 +18,38 @@ Writes (in OUT_DIR):
 from __future__ import annotations
 import argparse
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import cv2
 import numpy as np
-from PIL import Image
+import torch
 from ultralytics import FastSAM
 
+try:
+    from numba import njit, prange
+except ImportError:  # optional: falls back to the NumPy blend path
+    njit = None
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to compact stdlib json
+    orjson = None
+
+# NumPy >= 2.0: popcount over bit-packed masks for the batched area/border sums
+_HAS_BITWISE_COUNT = hasattr(np, "bitwise_count")
+
 # ============================
 # === USER SETTINGS (edit) ===
 # ============================
 
 FASTSAM_WEIGHTS = Path("./models/FastSAM-s.pt")
 
-IMGSZ = 768
+IMGSZ = 768                   # keep a multiple of 32 (model stride)
 CONF  = 0.4
 IOU   = 0.9
+HALF  = True                  # FP16 inference on CUDA/MPS (CPU always runs FP32)
 
 # ---- Background heuristics (practical) ----
 # 1) Too big => likely background blob (even if not touching borders)
@@ -47,6 +63,7 @@ BORDER_BAND_PX = 3            # border band thickness used to count border pixel
 ENABLE_HOLE_HEURISTIC = True
 HOLE_FRAC_TH = 0.08           # holes area / mask area
 MIN_HOLE_AREA_PX = 80         # ignore tiny pinholes
+HOLE_MAX_PIXELS = 512 * 512   # larger masks are subsampled to about this size for the hole check
 
 # ---- Noise floor ----
 MIN_INSTANCE_AREA_PX = 150
@@ -55,12 +72,17 @@ MIN_INSTANCE_AREA_PX = 150
 MIN_CONTOUR_AREA = 200
 EPS_FRACTION = 0.01
 MAX_POINTS = 256
+PARALLEL_MIN_MASKS = 4        # export masks on a thread pool from this many kept masks
 
 # ---- Morphology (avoid merging objects) ----
 DO_OPEN = True
 DO_CLOSE = False              # CLOSE can MERGE nearby objects into background-like blobs
 MORPH_ITERS = 1
 
+# ---- Output ----
+PNG_COMPRESSION = 3           # cv2 PNG level 0-9 (lower = faster encode, slightly larger file)
+PNG_COMPRESSION_FAST = 1      # level used by default (_imwrite_png fast=True)
+
 # ---- Debug ----
 DEBUG_PRINT_MASK_STATS = True
 DEBUG_SAVE_KEEP_DROP_IMAGES = True   # writes debug_keep_drop.png
@@ -75,165 +97,422 @@ def parse_args():
     return p.parse_args()
 
 
+def get_device() -> str:
+    if torch.cuda.is_available():
+        return "cuda"
+    if torch.backends.mps.is_available():
+        return "mps"
+    return "cpu"
+
+
+def _fixed_point(color, alpha):
+    """(inv, c_blend) integer blend weights shared by the NumPy and Numba paths."""
+    return int((1 - alpha) * 256), (np.asarray(color, dtype=np.float32) * alpha).astype(np.int32)
+
+
+def _blend_into(out, m, color, alpha):
+    """out[m] = out[m]*(1-alpha) + color*alpha in uint16 fixed point (no float image)."""
+    inv, c_blend = _fixed_point(color, alpha)
+    sel = out[m].astype(np.uint16)
+    out[m] = (((sel * inv) >> 8) + c_blend).astype(np.uint8)
+
+
+def _blend2_into(out, mask_a, mask_b, inv, c_a, c_b):
+    """
+    Two-mask form of _blend_into (c_a then c_b, same rounding) with a single
+    gather/scatter: each pixel's state (none/a/b/both) indexes a (4,3,256)
+    table of precomputed blend results.
+    """
+    v = np.arange(256, dtype=np.int32)
+    base = (v * inv) >> 8
+    s_a = base + c_a[:, None]
+    s_b = base + c_b[:, None]
+    s_ab = ((s_a * inv) >> 8) + c_b[:, None]
+    lut = np.stack([np.broadcast_to(v, s_a.shape), s_a, s_b, s_ab]).astype(np.uint8)
+
+    sel = np.bitwise_or(mask_a, np.left_shift(mask_b, 1), dtype=np.uint8)
+    idx = np.nonzero(sel)
+    out[idx] = lut[sel[idx][:, None], np.arange(3), out[idx]]
+
+
+if njit is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _blend_numba(rgb, mask, out, inv, c):
+        """One pass over the frame: same fixed-point blend as _blend_into where mask, copy elsewhere."""
+        h, w = mask.shape
+        for i in prange(h):
+            for j in range(w):
+                for k in range(3):
+                    v = np.int32(rgb[i, j, k])
+                    if mask[i, j]:
+                        v = ((v * inv) >> 8) + c[k]
+                    out[i, j, k] = v
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _blend2_numba(rgb, mask_a, mask_b, out, inv, c_a, c_b):
+        """Like _blend_numba, blending c_a then c_b, for two masks in a single pass."""
+        h, w = mask_a.shape
+        for i in prange(h):
+            for j in range(w):
+                for k in range(3):
+                    v = np.int32(rgb[i, j, k])
+                    if mask_a[i, j]:
+                        v = ((v * inv) >> 8) + c_a[k]
+                    if mask_b[i, j]:
+                        v = ((v * inv) >> 8) + c_b[k]
+                    out[i, j, k] = v
+
+else:
+    _blend_numba = _blend2_numba = None
+
+
+def _as_bool(mask01: np.ndarray) -> np.ndarray:
+    """Bool view of a 0/1 uint8 mask (no copy); other dtypes are cast."""
+    return mask01.view(bool) if mask01.dtype == np.uint8 else mask01.astype(bool)
+
+
 def overlay_mask(rgb, mask01, alpha=0.55):
-    out = rgb.astype(np.float32).copy()
-    m = mask01.astype(bool)
-    color = np.array([0, 255, 0], dtype=np.float32)
-    out[m] = out[m] * (1 - alpha) + color * alpha
-    return np.clip(out, 0, 255).astype(np.uint8)
+    if _blend_numba is not None:
+        out = np.empty_like(rgb)
+        inv, c = _fixed_point((0, 255, 0), alpha)
+        _blend_numba(rgb, np.ascontiguousarray(mask01), out, inv, c)
+        return out
+    out = rgb.copy()
+    _blend_into(out, _as_bool(mask01), (0, 255, 0), alpha)
+    return out
+
+
+def _imwrite_png(path, arr, fast: bool = True, extra_params=()):
+    """Write an RGB/RGBA/grayscale uint8 array as PNG through OpenCV."""
+    if arr.ndim == 3:
+        arr = cv2.cvtColor(arr, cv2.COLOR_RGBA2BGRA if arr.shape[2] == 4 else cv2.COLOR_RGB2BGR)
+    level = PNG_COMPRESSION_FAST if fast else PNG_COMPRESSION
+    if not cv2.imwrite(str(path), arr, [cv2.IMWRITE_PNG_COMPRESSION, level, *extra_params]):
+        raise RuntimeError(f"Could not write image: {path}")
+
+
+def _write_json(path: Path, payload: dict):
+    """Compact JSON write (Unity's parser does not need indentation)."""
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(payload))
+    else:
+        path.write_text(json.dumps(payload, separators=(",", ":")))
 
 
 def save_mask_png(mask01, path):
-    Image.fromarray((mask01.astype(np.uint8) * 255)).save(path)
+    # 1-bit grayscale PNG (mode "1"); libpng packs any nonzero byte as 1, so the
+    # 0/1 mask is written as-is and decoders read it back as 0/255
+    _imwrite_png(path, np.ascontiguousarray(mask01, dtype=np.uint8), extra_params=(cv2.IMWRITE_PNG_BILEVEL, 1))
+
 
+def make_rgba(rgb: np.ndarray, mask01: np.ndarray) -> np.ndarray:
+    """RGB + 0/255 alpha from a 0/1 mask, filled into one preallocated buffer."""
+    h, w = mask01.shape
+    rgba = np.empty((h, w, 4), dtype=np.uint8)
+    rgba[..., :3] = rgb
+    np.multiply(mask01, 255, out=rgba[..., 3], dtype=np.uint8, casting="unsafe")
+    return rgba
 
-def simplify_polygon(poly_xy: np.ndarray):
-    if poly_xy.shape[0] < 3:
+
+def simplify_polygon(contour: np.ndarray):
+    """Simplify a raw cv2.findContours contour ((-1,1,2) int32, used as-is) to a list of [x, y]."""
+    if contour.shape[0] < 3:
         return []
 
-    pts = poly_xy.astype(np.float32).reshape(-1, 1, 2)
-    peri = cv2.arcLength(pts, True)
+    peri = cv2.arcLength(contour, True)
     eps = max(1.0, EPS_FRACTION * peri)
-    approx = cv2.approxPolyDP(pts, eps, True)
-    approx_xy = approx.reshape(-1, 2)
+    # int32 in -> int32 vertices out, so no float copy or rounding is needed
+    approx_xy = cv2.approxPolyDP(contour, eps, True).reshape(-1, 2)
 
     if approx_xy.shape[0] > MAX_POINTS:
         idx = np.linspace(0, approx_xy.shape[0] - 1, MAX_POINTS).astype(int)
         approx_xy = approx_xy[idx]
 
-    out = [[int(round(x)), int(round(y))] for x, y in approx_xy]
+    out = approx_xy.tolist()
     if len(out) >= 2 and out[0] == out[-1]:
         out = out[:-1]
     return out
 
 
-def _morph_clean(binary255: np.ndarray) -> np.ndarray:
-    m = binary255
-    kernel = np.ones((3, 3), np.uint8)
+_MORPH_KERNEL = np.ones((3, 3), np.uint8)
+
+
+def _morph_clean(binary255: np.ndarray, dst: np.ndarray | None = None) -> np.ndarray:
+    """Open then close binary255 into dst (allocated if None); the close runs in place."""
+    if dst is None:
+        dst = np.empty_like(binary255)
     if DO_OPEN:
-        m = cv2.morphologyEx(m, cv2.MORPH_OPEN, kernel, iterations=MORPH_ITERS)
+        cv2.morphologyEx(binary255, cv2.MORPH_OPEN, _MORPH_KERNEL, dst=dst, iterations=MORPH_ITERS)
+    else:
+        np.copyto(dst, binary255)
     if DO_CLOSE:
-        m = cv2.morphologyEx(m, cv2.MORPH_CLOSE, kernel, iterations=MORPH_ITERS)
-    return m
-
+        cv2.morphologyEx(dst, cv2.MORPH_CLOSE, _MORPH_KERNEL, dst=dst, iterations=MORPH_ITERS)
+    return dst
 
-def border_touch_frac(mask01: np.ndarray, band_px: int = 3) -> float:
-    """Fraction of mask pixels that lie within a border band."""
-    m = mask01.astype(bool)
-    total = float(m.sum())
-    if total <= 1e-9:
-        return 0.0
 
-    h, w = m.shape
-    b = max(1, int(band_px))
+def _count_nonzero(mask: np.ndarray) -> int:
+    """Pixel count of a 2D mask; cv2.countNonZero (SIMD) for uint8/bool, NumPy otherwise."""
+    if mask.dtype in (np.uint8, np.bool_):
+        return cv2.countNonZero(np.ascontiguousarray(mask).view(np.uint8))
+    return int(np.count_nonzero(mask))
 
-    border = np.zeros((h, w), dtype=bool)
-    border[:b, :] = True
-    border[-b:, :] = True
-    border[:, :b] = True
-    border[:, -b:] = True
 
-    touch = float((m & border).sum())
-    return touch / total
+# floodFill mask buffers reused across hole_frac calls, keyed by shape
+# (hole_frac runs serially during classification; not thread-safe)
+_FLOOD_SCRATCH: dict[tuple[int, int], np.ndarray] = {}
 
 
-def hole_frac(mask01: np.ndarray, min_hole_area_px: int = 80) -> float:
+def hole_frac(m255: np.ndarray, min_hole_area_px: int = 80) -> float:
     """
-    Approx hole area / mask area.
-    Fill holes by flood fill on inverted mask. Remaining enclosed regions are holes.
+    Approx hole area / mask area, for a mask already cast to 0/255 uint8.
+    Flood the outside region from the corner; non-mask pixels it does not
+    reach are holes.
     """
-    m = (mask01.astype(np.uint8) * 255)
-    total = float((m > 0).sum())
+    total = float(_count_nonzero(m255))
     if total <= 1e-9:
         return 0.0
 
-    inv = cv2.bitwise_not(m)
-    h, w = inv.shape[:2]
-    ff = inv.copy()
-    flood_mask = np.zeros((h + 2, w + 2), np.uint8)
-    cv2.floodFill(ff, flood_mask, (0, 0), 0)
-
-    holes = (ff > 0).astype(np.uint8)
+    # MASK_ONLY leaves m255 untouched and marks the 4-connected region of the
+    # corner pixel's value with 255 in flood_mask, so no inverted copy is needed
+    h, w = m255.shape[:2]
+    flood_mask = _FLOOD_SCRATCH.get((h + 2, w + 2))
+    if flood_mask is None:
+        flood_mask = _FLOOD_SCRATCH[(h + 2, w + 2)] = np.zeros((h + 2, w + 2), np.uint8)
+    else:
+        flood_mask.fill(0)
+    cv2.floodFill(m255, flood_mask, (0, 0), 0, flags=4 | cv2.FLOODFILL_MASK_ONLY | (255 << 8))
+
+    # holes = ~(mask | flooded), built in place in the flood mask interior
+    ff = flood_mask[1:-1, 1:-1]
+    cv2.bitwise_or(ff, m255, dst=ff)
+    cv2.bitwise_not(ff, dst=ff)
+
+    # remove tiny holes: the component stats already hold each hole's area,
+    # so no per-label pass over the label image is needed.
+    _num, _lbl, stats, _ = cv2.connectedComponentsWithStats(ff, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA]
+    hole_area = float(areas[areas >= min_hole_area_px].sum())
+    return hole_area / total
 
-    # remove tiny holes
-    num, lbl, stats, _ = cv2.connectedComponentsWithStats(holes, connectivity=8)
-    holes_big = np.zeros_like(holes)
-    for i in range(1, num):
-        area = stats[i, cv2.CC_STAT_AREA]
-        if area >= min_hole_area_px:
-            holes_big[lbl == i] = 1
 
-    hole_area = float(holes_big.sum())
-    return hole_area / total
+def _band_slices(h: int, w: int, band_px: int) -> tuple[tuple[slice, slice], ...]:
+    """
+    (rows, cols) slices of the four border strips: top, bottom, then left and
+    right between them. Clamped so no pixel is counted twice when the image is
+    narrower or shorter than two bands.
+    """
+    b = max(1, int(band_px))
+    mid = slice(b, max(b, h - b))
+    return (
+        (slice(0, b), slice(None)),
+        (slice(max(b, h - b), h), slice(None)),
+        (mid, slice(0, b)),
+        (mid, slice(max(b, w - b), w)),
+    )
 
 
-def is_background_like(mask01: np.ndarray) -> tuple[bool, str, dict]:
-    area = int(mask01.sum())
-    h, w = mask01.shape
-    area_frac = area / float(h * w) if (h * w) > 0 else 0.0
-    bfrac = border_touch_frac(mask01, BORDER_BAND_PX)
-    hfrac = hole_frac(mask01, MIN_HOLE_AREA_PX) if ENABLE_HOLE_HEURISTIC else 0.0
+def _border_band_sums(masks01: np.ndarray, band_px: int, idx: np.ndarray | None = None) -> np.ndarray:
+    """
+    (N,) pixel counts inside the border band, summed from the four edge strips
+    only. With idx, only those masks are counted (strips are sliced before
+    indexing, so no full mask is copied).
+    """
+    _, h, w = masks01.shape
+    strips = tuple(masks01[:, rs, cs] for rs, cs in _band_slices(h, w, band_px))
+    if idx is not None:
+        strips = tuple(s[idx] for s in strips)
+    return sum(s.sum(axis=(1, 2), dtype=np.int64) for s in strips)
+
+
+def _packed_border_sums(packed: np.ndarray, h: int, w: int, band_px: int, idx: np.ndarray) -> np.ndarray:
+    """_border_band_sums for np.packbits(masks01, axis=-1) masks of size h x w, via popcount."""
+    top, bottom, (mid, left), (_, right) = _band_slices(h, w, band_px)
+    cols = np.zeros(w, dtype=bool)
+    cols[left] = True
+    cols[right] = True
+    col_bits = np.packbits(cols)
+    col_bytes = np.flatnonzero(col_bits)  # only the bytes holding left/right band columns
+    strips = (
+        packed[:, top[0]][idx],
+        packed[:, bottom[0]][idx],
+        packed[:, mid, col_bytes][idx] & col_bits[col_bytes],
+    )
+    return sum(np.bitwise_count(s).sum(axis=(1, 2), dtype=np.int64) for s in strips)
+
+
+def _classify_from_stats(areas: np.ndarray, h: int, w: int, border_sums, fetch) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Rule chain shared by the NumPy and torch classifiers, cheapest rule first.
+    areas is the (N,) host array of mask areas. border_sums(idx) returns the
+    (k,) border-band counts and is only called for masks that pass the area
+    rules; fetch(idx, step) returns masks[idx, ::step, ::step] as host 0/255
+    uint8 (cast once per batch, the form hole_frac works on) and is only
+    called for masks that also pass the border rule. Stats that were never
+    computed stay 0.
+    """
+    n = areas.shape[0]
+    area_frac = areas / float(h * w) if (h * w) > 0 else np.zeros(n)
+    bfrac = np.zeros(n)
+    hfrac = np.zeros(n)
+
+    too_small = areas < MIN_INSTANCE_AREA_PX
+    too_large = ~too_small & (area_frac >= BG_AREA_FRAC_TH)
+    sized = np.flatnonzero(~(too_small | too_large))
+    if sized.size:
+        bfrac[sized] = border_sums(sized) / np.maximum(areas[sized], 1)
+    border = ~too_small & ~too_large & (bfrac >= BORDER_TOUCH_FRAC_TH)
+    holed = np.zeros(n, dtype=bool)
+    if ENABLE_HOLE_HEURISTIC:
+        cand = np.flatnonzero(~(too_small | too_large | border))
+        if cand.size:
+            # hole_frac is a ratio, so it can run on a strided (nearest) subsample;
+            # only the pinhole size threshold has to follow the pixel scale
+            step = max(1, int(np.ceil(np.sqrt(h * w / HOLE_MAX_PIXELS))))
+            small255 = fetch(cand, step)
+            min_hole = MIN_HOLE_AREA_PX * small255[0].size / float(h * w)
+            for i, m255 in zip(cand, small255):
+                hfrac[i] = hole_frac(m255, min_hole)
+        holed = ~(too_small | too_large | border) & (hfrac >= HOLE_FRAC_TH)
+
+    reasons = []
+    for i in range(n):
+        if too_small[i]:
+            reasons.append(f"too_small area={areas[i]}")
+        elif too_large[i]:
+            # Practical background catch: very large interior blob
+            reasons.append(f"too_large area_frac={area_frac[i]:.3f} >= {BG_AREA_FRAC_TH}")
+        elif border[i]:
+            # Typical background: touches borders a lot
+            reasons.append(f"border_touch_frac={bfrac[i]:.3f} >= {BORDER_TOUCH_FRAC_TH}")
+        elif holed[i]:
+            # Optional weird/holed background
+            reasons.append(f"hole_frac={hfrac[i]:.3f} >= {HOLE_FRAC_TH}")
+        else:
+            reasons.append("kept")
 
+    drop = too_small | too_large | border | holed
     stats = {
-        "area": area,
+        "area": areas,
         "area_frac": area_frac,
         "border_touch_frac": bfrac,
         "hole_frac": hfrac,
+        "reason": reasons,
     }
+    return np.flatnonzero(~drop), np.flatnonzero(drop), stats
+
+
+def classify_masks_batched(masks01: np.ndarray) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Background/noise classification for all (N,H,W) 0/1 host masks at once
+    (used by main when inference ran on CPU; see classify_masks_torch). Areas are one reduction over the whole stack; border-touch sums only run
+    for masks that pass the area rules and the (expensive) hole heuristic only
+    for masks that also pass the border rule.
+    Returns (keep_idx, drop_idx, stats) where stats holds (N,) arrays plus a
+    per-mask "reason" list. Rules are applied in order: too small, too large,
+    border touch, holes.
+    """
+    n, h, w = masks01.shape
+    if _HAS_BITWISE_COUNT:
+        # Pack once (8 px per byte); area and border sums then read 1/8 of the bytes
+        packed = np.packbits(masks01, axis=-1)
+        areas = np.bitwise_count(packed).reshape(n, -1).sum(axis=1, dtype=np.int64)
+
+        def border_sums(idx):
+            return _packed_border_sums(packed, h, w, BORDER_BAND_PX, idx)
+    else:
+        areas = masks01.reshape(n, -1).sum(axis=1, dtype=np.int64)
+
+        def border_sums(idx):
+            return _border_band_sums(masks01, BORDER_BAND_PX, idx)
+
+    def fetch(idx, step):
+        sel = masks01[:, ::step, ::step][idx].view(np.uint8)  # fresh copy; bool views as 0/1
+        sel *= 255
+        return sel
+
+    return _classify_from_stats(areas, h, w, border_sums, fetch)
+
+
+def masks_to_host(masks_bool, idx=None) -> np.ndarray:
+    """Gather (a subset of) an (N,H,W) bool mask tensor to host as uint8 0/1."""
+    if idx is not None:
+        masks_bool = masks_bool[torch.as_tensor(idx, device=masks_bool.device)]
+    return masks_bool.byte().cpu().numpy()
+
+
+def classify_masks_torch(masks_bool) -> tuple[np.ndarray, np.ndarray, dict]:
+    """
+    Same as classify_masks_batched for an (N,H,W) bool tensor on a GPU (CUDA/MPS)
+    inference device. Area and border reductions run on-device; only the (N,) stats and
+    the hole-heuristic candidates are copied to host.
+    """
+    n, h, w = masks_bool.shape
+    areas = masks_bool.reshape(n, -1).sum(dim=1)
 
-    if area < MIN_INSTANCE_AREA_PX:
-        return True, f"too_small area={area}", stats
+    def border_sums(idx):
+        sel = torch.as_tensor(idx, device=masks_bool.device)
+        strips = (masks_bool[:, rs, cs] for rs, cs in _band_slices(h, w, BORDER_BAND_PX))
+        return sum(s[sel].sum(dim=(1, 2)) for s in strips).cpu().numpy()
 
-    # Practical background catch: very large interior blob
-    if area_frac >= BG_AREA_FRAC_TH:
-        return True, f"too_large area_frac={area_frac:.3f} >= {BG_AREA_FRAC_TH}", stats
+    def fetch(idx, step):
+        # 0/255 cast on-device, so the host receives hole_frac's input form directly
+        sel = masks_bool[:, ::step, ::step][torch.as_tensor(idx, device=masks_bool.device)]
+        return sel.byte().mul_(255).cpu().numpy()
 
-    # Typical background: touches borders a lot
-    if bfrac >= BORDER_TOUCH_FRAC_TH:
-        return True, f"border_touch_frac={bfrac:.3f} >= {BORDER_TOUCH_FRAC_TH}", stats
+    return _classify_from_stats(areas.cpu().numpy(), h, w, border_sums, fetch)
 
-    # Optional weird/holed background
-    if ENABLE_HOLE_HEURISTIC and hfrac >= HOLE_FRAC_TH:
-        return True, f"hole_frac={hfrac:.3f} >= {HOLE_FRAC_TH}", stats
 
-    return False, "kept", stats
+def _process_one_mask(mi: int, m01: np.ndarray, src255: np.ndarray | None = None,
+                      m255: np.ndarray | None = None) -> tuple[dict | None, str]:
+    """Morphology + largest outer contour + simplify for one mask. Returns (polygon or None, debug line)."""
+    if src255 is None:
+        src255 = np.empty(m01.shape, dtype=np.uint8)
+    np.multiply(m01, 255, out=src255, dtype=np.uint8)
+    m255 = _morph_clean(src255, dst=m255)
+
+    contours, _ = cv2.findContours(m255, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None, f"[DBG] mask {mi}: 0 contours"
+
+    contours = sorted(contours, key=cv2.contourArea, reverse=True)
+    c = contours[0]
+    area = cv2.contourArea(c)
+
+    if area < MIN_CONTOUR_AREA:
+        return None, f"[DBG] mask {mi}: contour too small area={area:.1f} < MIN_CONTOUR_AREA={MIN_CONTOUR_AREA}"
+
+    poly = simplify_polygon(c)
+    if len(poly) < 3:
+        return None, f"[DBG] mask {mi}: simplify produced <3 points"
+
+    return {
+        "label": "object",
+        "outer": poly,
+        "holes": [],
+        "area_px": float(area),
+        "mask_index": int(mi),
+    }, f"[DBG] mask {mi}: polygon kept area={area:.1f}, points={len(poly)}"
 
 
 def export_contours_from_masks(masks01: np.ndarray, out_json: Path, w: int, h: int) -> int:
+    n = masks01.shape[0]
+    if n >= PARALLEL_MIN_MASKS:
+        # cv2 releases the GIL, so threads scale without pickling masks to worker processes
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as ex:
+            results = list(ex.map(_process_one_mask, range(n), masks01))
+    else:
+        # Scratch buffers reused for every mask
+        src255 = np.empty(masks01.shape[1:], dtype=np.uint8)
+        m255 = np.empty_like(src255)
+        results = [_process_one_mask(mi, masks01[mi], src255, m255) for mi in range(n)]
+
     polys = []
-    kept = 0
-
-    for mi in range(masks01.shape[0]):
-        m01 = masks01[mi].astype(np.uint8)
-        m255 = _morph_clean(m01 * 255)
-
-        contours, _ = cv2.findContours(m255, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not contours:
-            print(f"[DBG] mask {mi}: 0 contours")
-            continue
-
-        contours = sorted(contours, key=cv2.contourArea, reverse=True)
-        c = contours[0]
-        area = cv2.contourArea(c)
-
-        if area < MIN_CONTOUR_AREA:
-            print(f"[DBG] mask {mi}: contour too small area={area:.1f} < MIN_CONTOUR_AREA={MIN_CONTOUR_AREA}")
-            continue
-
-        poly = simplify_polygon(c.reshape(-1, 2))
-        if len(poly) < 3:
-            print(f"[DBG] mask {mi}: simplify produced <3 points")
-            continue
-
-        polys.append({
-            "label": "object",
-            "outer": poly,
-            "holes": [],
-            "area_px": float(area),
-            "mask_index": int(mi),
-        })
-        kept += 1
-        print(f"[DBG] mask {mi}: polygon kept area={area:.1f}, points={len(poly)}")
+    for poly, msg in results:
+        print(msg)
+        if poly is not None:
+            polys.append(poly)
+    kept = len(polys)
 
     polys.sort(key=lambda p: p["area_px"], reverse=True)
 
@@ -243,13 +522,13 @@ def export_contours_from_masks(masks01: np.ndarray, out_json: Path, w: int, h: i
         "polygons": polys,
         "notes": "FastSAM per-instance masks. Background excluded via area + border-touch + hole heuristics."
     }
-    out_json.write_text(json.dumps(payload, indent=2))
+    _write_json(out_json, payload)
     return kept
 
 
-def get_masks_from_result(res0) -> np.ndarray:
-    arr = res0.masks.data.detach().cpu().numpy()
-    return (arr > 0.5).astype(np.uint8)
+def get_masks_from_result(res0):
+    # (N,H,W) bool tensor, left on the inference device; see masks_to_host
+    return res0.masks.data.detach() > 0.5
 
 
 def make_debug_keep_drop_image(rgb: np.ndarray, keep_union: np.ndarray, drop_union: np.ndarray) -> np.ndarray:
@@ -258,19 +537,19 @@ def make_debug_keep_drop_image(rgb: np.ndarray, keep_union: np.ndarray, drop_uni
       - kept masks overlayed in GREEN
       - dropped masks overlayed in RED
     """
-    out = rgb.astype(np.float32).copy()
-
-    keep = keep_union.astype(bool)
-    drop = drop_union.astype(bool)
-
-    green = np.array([0, 255, 0], dtype=np.float32)
-    red = np.array([255, 0, 0], dtype=np.float32)
-
     alpha = 0.55
-    out[keep] = out[keep] * (1 - alpha) + green * alpha
-    out[drop] = out[drop] * (1 - alpha) + red * alpha
-
-    return np.clip(out, 0, 255).astype(np.uint8)
+    if _blend2_numba is not None:
+        out = np.empty_like(rgb)
+        inv, green = _fixed_point((0, 255, 0), alpha)
+        _, red = _fixed_point((255, 0, 0), alpha)
+        _blend2_numba(rgb, keep_union, drop_union, out, inv, green, red)
+        return out
+
+    out = rgb.copy()
+    inv, green = _fixed_point((0, 255, 0), alpha)
+    _, red = _fixed_point((255, 0, 0), alpha)
+    _blend2_into(out, keep_union, drop_union, inv, green, red)
+    return out
 
 
 def main():
@@ -295,89 +574,84 @@ def main():
     if w <= 256 or h <= 256:
         print("[WARN] Image is very small. Objects may merge/disappear. Use higher-res capture if possible.")
 
+    device = get_device()
+    half = HALF and device != "cpu"
+    print("[INFO] Device:", device, "(fp16)" if half else "(fp32)")
+
     model = FastSAM(str(FASTSAM_WEIGHTS))
-    results = model(str(in_path), retina_masks=True, imgsz=IMGSZ, conf=CONF, iou=IOU)
+    results = model(str(in_path), retina_masks=True, imgsz=IMGSZ, conf=CONF, iou=IOU, device=device, half=half)
     res0 = results[0]
 
     if res0.masks is None:
         print("[WARN] No masks detected")
-        Image.fromarray(rgb).save(out_dir / "overlay.png")
+        _imwrite_png(out_dir / "overlay.png", rgb)
         return
 
-    masks = get_masks_from_result(res0)  # (N,H,W)
-    areas = masks.reshape(masks.shape[0], -1).sum(axis=1)
-    order = np.argsort(-areas)
-    masks = masks[order]
-    areas = areas[order]
+    masks = get_masks_from_result(res0)  # (N,H,W) bool tensor on device
+    if masks.device.type == "cpu":
+        # Host path: zero-copy uint8 view of the bool tensor, classified in NumPy
+        keep_idx, drop_idx, stats = classify_masks_batched(masks.numpy().view(np.uint8))
+    else:
+        keep_idx, drop_idx, stats = classify_masks_torch(masks)
 
     print(f"[INFO] Raw masks: {masks.shape[0]}")
     if masks.shape[0] > 0:
-        print(f"[INFO] Largest mask area_frac (raw): {float(areas[0]) / img_area:.3f}")
-
-    kept_masks = []
-    dropped_masks = []
+        # Only the largest is needed here; polygons are sorted by area on export
+        print(f"[INFO] Largest mask area_frac (raw): {float(stats['area'].max()) / img_area:.3f}")
 
+    dropped = set(drop_idx.tolist())
     for i in range(masks.shape[0]):
-        m = masks[i]
-        is_bg, reason, stats = is_background_like(m)
+        is_bg = i in dropped
+        reason = stats["reason"][i]
 
         if DEBUG_PRINT_MASK_STATS:
             print(
                 f"[DBG] mask {i}: "
-                f"area={stats['area']} "
-                f"area_frac={stats['area_frac']:.3f} "
-                f"border_touch={stats['border_touch_frac']:.3f} "
-                f"hole_frac={stats['hole_frac']:.3f} "
+                f"area={stats['area'][i]} "
+                f"area_frac={stats['area_frac'][i]:.3f} "
+                f"border_touch={stats['border_touch_frac'][i]:.3f} "
+                f"hole_frac={stats['hole_frac'][i]:.3f} "
                 f"=> {('DROP' if is_bg else 'KEEP')} ({reason})"
             )
         else:
             print(f"[DBG] mask {i}: {('DROP' if is_bg else 'KEEP')} ({reason})")
 
-        if is_bg:
-            dropped_masks.append(m)
-        else:
-            kept_masks.append(m)
-
-    if len(kept_masks) == 0:
+    if keep_idx.size == 0:
         print("[WARN] All masks dropped. Loosen thresholds:")
         print("       - increase BG_AREA_FRAC_TH (e.g., 0.55)")
         print("       - increase BORDER_TOUCH_FRAC_TH (e.g., 0.15)")
         print("       - disable hole heuristic (ENABLE_HOLE_HEURISTIC=False)")
         # Save debug visuals anyway
-        union_all = np.maximum.reduce(masks) if masks.shape[0] else np.zeros((h, w), dtype=np.uint8)
+        union_all = masks_to_host(masks.any(dim=0))
         save_mask_png(union_all, out_dir / "objects_mask.png")
-        rgba = np.dstack([rgb, (union_all * 255).astype(np.uint8)])
-        Image.fromarray(rgba).save(out_dir / "objects_only_rgba.png")
-        Image.fromarray(overlay_mask(rgb, union_all)).save(out_dir / "overlay.png")
-        (out_dir / "objects_contour.json").write_text(json.dumps({
+        _imwrite_png(out_dir / "objects_only_rgba.png", make_rgba(rgb, union_all))
+        _imwrite_png(out_dir / "overlay.png", overlay_mask(rgb, union_all))
+        _write_json(out_dir / "objects_contour.json", {
             "image_w": int(w), "image_h": int(h), "polygons": [],
             "notes": "All masks dropped as background/noise by heuristics."
-        }, indent=2))
+        })
         return
 
-    masks_kept = np.stack(kept_masks, axis=0)
+    masks_kept = masks_to_host(masks, keep_idx)
     print(f"[INFO] Masks kept: {masks_kept.shape[0]}")
 
     # Union for visuals (kept only)
-    keep_union = np.zeros((h, w), dtype=np.uint8)
-    for m in masks_kept:
-        keep_union = np.maximum(keep_union, m)
+    keep_union = np.empty((h, w), dtype=np.uint8)
+    np.bitwise_or.reduce(masks_kept, axis=0, out=keep_union)
 
     save_mask_png(keep_union, out_dir / "objects_mask.png")
 
-    rgba = np.dstack([rgb, (keep_union * 255).astype(np.uint8)])
-    Image.fromarray(rgba).save(out_dir / "objects_only_rgba.png")
+    rgba = make_rgba(rgb, keep_union)
+    _imwrite_png(out_dir / "objects_only_rgba.png", rgba)
 
-    Image.fromarray(overlay_mask(rgb, keep_union)).save(out_dir / "overlay.png")
+    _imwrite_png(out_dir / "overlay.png", overlay_mask(rgb, keep_union))
 
     # Optional debug image: green=kept, red=dropped
     if DEBUG_SAVE_KEEP_DROP_IMAGES:
-        drop_union = np.zeros((h, w), dtype=np.uint8)
-        for m in dropped_masks:
-            drop_union = np.maximum(drop_union, m)
+        drop_union = masks_to_host(masks[torch.as_tensor(drop_idx, device=masks.device)].any(dim=0))
 
         dbg = make_debug_keep_drop_image(rgb, keep_union, drop_union)
-        Image.fromarray(dbg).save(out_dir / "debug_keep_drop.png")
+        _imwrite_png(out_dir / "debug_keep_drop.png", dbg)
         print("[SAVED] debug_keep_drop.png (green=kept, red=dropped)")
 
     # Contours per kept mask